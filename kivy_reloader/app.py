@@ -17,6 +17,10 @@ from kivy.utils import platform
 from .config import config
 from .utils import get_kv_files_paths
 
+# Entry of the archive sent to the phone listing
+# the files deleted since the previous send
+DELETED_FILES_MANIFEST = ".reloader_deleted_files"
+
 
 class Reloader(F.Screen):
     pass
@@ -46,16 +50,28 @@ def infiniteloop():
 
 
 if platform != "android":
-    import inspect
+    import io
     import logging
-    from fnmatch import fnmatch
-    from shutil import copytree, ignore_patterns, rmtree
+    import signal
+    import threading
+    import zipfile
+    from graphlib import CycleError, TopologicalSorter
 
     from kaki.app import App
     from kivy.clock import Clock, mainthread
     from kivy.core.window import Window
 
-    from .utils import get_auto_reloader_paths
+    from .send_app_to_phone import send_app
+    from .utils import (
+        compile_patterns,
+        find_imported_modules,
+        get_auto_reloader_paths,
+        get_file_hash,
+        get_file_stat_key,
+        is_network_path,
+        merge_watched_folders,
+        walk_files,
+    )
 
     Window.always_on_top = True
     logging.getLogger("watchdog").setLevel(logging.ERROR)
@@ -64,6 +80,14 @@ if platform != "android":
     class App(App):
         subprocesses = []
 
+        # zlib compression level of the archive sent to the phone.
+        # Source files are small, so a fast level beats a smaller archive
+        ZIP_COMPRESS_LEVEL = 1
+
+        # Seconds without file changes to wait before rebuilding, so the
+        # burst of events of a single save triggers one rebuild only
+        REBUILD_DEBOUNCE = 0.2
+
         def __init__(self, *args, **kwargs):
             super().__init__(*args, **kwargs)
             self.built = False
@@ -72,11 +96,47 @@ if platform != "android":
             self.AUTORELOADER_PATHS: list = get_auto_reloader_paths()
             self.HOT_RELOAD_ON_PHONE: bool = config.HOT_RELOAD_ON_PHONE
             self.KV_FILES: list = get_kv_files_paths()
+            self._kv_realpaths = [os.path.realpath(path) for path in self.KV_FILES]
+            # The reloader never changes directory, so these stay valid
+            self._cwd = os.getcwd()
+            self._root_path = self.get_root_path()
+            self._python_files_to_unload = None
+            self._module_names = {}
+            self._filename_modules = {}
+            self._imports_cache = {}
+            self._file_hash_cache = {}
+            # Hash of every file the phone has, by archive name
+            self._phone_file_hashes = {}
+            self._send_lock = trio.Lock()
+            # Set when a send is asked before the event loop runs
+            self._send_on_start = False
+            # Watch patterns are compiled once, not on every event
+            self._is_full_reload_file = compile_patterns(
+                *(
+                    os.path.join(self._root_path, path)
+                    for path in config.FULL_RELOAD_FILES
+                )
+            )
+            self._is_ignored_file = compile_patterns(
+                *config.DO_NOT_WATCH_PATTERNS,
+                *(os.path.join(self._cwd, pat) for pat in config.DO_NOT_WATCH_PATTERNS),
+            )
+            # Paths changed since the last flush, filled by the watchdog thread
+            self._pending_paths = set()
+            # Modification time and size of every path when it was last handled
+            self._flushed_stats = {}
+            # Changed python files not reloaded yet, they are kept when
+            # a reload fails so the next change retries them
+            self._unreloaded_python_files = []
+            self._pending_lock = threading.Lock()
+            self._flush_trigger = Clock.create_trigger(
+                self._flush_pending, self.REBUILD_DEBOUNCE
+            )
             self._build()
             if (
                 platform == "win"
             ):  # this is to make sure last spawned process on windows calls for parent Python process to be exited by PID when window is closed normally
-                Window.bind(on_request_close=self.on_request_close)
+                Window.fbind("on_request_close", self.on_request_close)
                 # https://stackoverflow.com/questions/54501099/how-to-run-a-method-on-the-exit-of-a-kivy-app
 
         def on_request_close(self, *args, **kwargs):
@@ -84,20 +144,28 @@ if platform != "android":
             # only on windows
 
             if platform == "win" and len(sys.argv) > 1:
-                killstring = f"taskkill /F /PID {sys.argv[1]}"
                 Logger.info(
                     f"Reloader: Detected request close on Windows. Closing original host Python PID: {sys.argv[1]}"
                 )
-                os.system(killstring)
+                # On Windows, SIGTERM calls TerminateProcess directly,
+                # without spawning taskkill
+                try:
+                    os.kill(int(sys.argv[1]), signal.SIGTERM)
+                except (OSError, ValueError):
+                    # The host already exited, or argv is not a PID
+                    pass
 
         def _restart_app(self, mod):
             _has_execv = sys.platform != "win32"
             original_argv = sys.argv
             cmd = [sys.executable] + original_argv
             if not _has_execv:
+                # Terminate every child first, so they all exit in parallel
                 for p in self.subprocesses:
                     p.terminate()
+                for p in self.subprocesses:
                     p.wait()
+                self.subprocesses.clear()
                 if len(sys.argv) <= 1:
                     cmd.append(str(os.getpid()))
                 p = subprocess.Popen(cmd, shell=False)
@@ -141,23 +209,27 @@ if platform != "android":
             """
 
             def _on_keyboard(window, keycode, scancode, codepoint, modifier_keys):
-                pressed_modifiers = set(modifier_keys)
-
-                if keycode == 286 or (keycode == 114 and "ctrl" in pressed_modifiers):
+                if keycode == 286 or (keycode == 114 and "ctrl" in modifier_keys):
                     return self.rebuild()
 
-            Window.bind(on_keyboard=_on_keyboard)
+            Window.fbind("on_keyboard", _on_keyboard)
 
         def build_root_and_add_to_window(self):
             Logger.info("Reloader: Building root widget and adding to window")
             if self.root is not None:
                 self.root.clear_widgets()
-
-                while Window.children:
-                    Window.remove_widget(Window.children[0])
+                self.clear_window()
 
             Clock.schedule_once(self.delayed_build)
 
+        def clear_window(self):
+            """
+            Removes every widget from the window, walking a snapshot
+            of its children instead of re-reading the list each time
+            """
+            for child in list(Window.children):
+                Window.remove_widget(child)
+
         def delayed_build(self, *args):
             self.root = self.build()
 
@@ -196,6 +268,8 @@ if platform != "android":
             async with trio.open_nursery() as nursery:
                 Logger.info("Reloader: Starting Async Kivy app")
                 self.nursery = nursery
+                if self._send_on_start:
+                    nursery.start_soon(self.send_app_to_phone)
                 self._run_prepare()
                 await async_runTouchApp(async_lib=async_lib)
                 self._stop()
@@ -206,65 +280,179 @@ if platform != "android":
                 return
 
             if module_name in sys.modules:
-                full_path = os.path.join(os.getcwd(), filename)
+                full_path = os.path.join(self._cwd, filename)
                 F.unregister_from_filename(full_path)
                 self._unregister_factory_from_module(module_name)
                 importlib.reload(sys.modules[module_name])
 
+        def get_module_name(self, filename):
+            """
+            Returns the module name of a python file, relative to the
+            working directory. Computed once per file
+            """
+            module_name = self._module_names.get(filename)
+            if module_name is None:
+                module_name = os.path.relpath(filename, self._cwd)
+                module_name = module_name.replace(os.path.sep, ".")[:-3]
+                self._module_names[filename] = module_name
+            return module_name
+
         def unload_files(self, files):
+            loaded_modules = sys.modules
             for filename in files:
-                module_name = os.path.relpath(filename).replace(os.path.sep, ".")[:-3]
-                self.unload_python_file(filename, module_name)
+                module_name = self.get_module_name(filename)
+                # Files that were never imported have nothing to unload,
+                # deleted ones can not be reloaded
+                if module_name in loaded_modules and os.path.isfile(filename):
+                    self.unload_python_file(filename, module_name)
 
-        def unload_python_files_on_desktop(self):
-            files_to_unload = []
+        def get_python_files_to_unload(self):
+            """
+            Returns the python files that are unloaded on every rebuild.
+            The list is cached, and only gathered again after watchdog
+            reports a file being created, deleted or moved
+            """
+            if self._python_files_to_unload is not None:
+                return self._python_files_to_unload
 
             # Gather files from recursively watched folders
-            for folder in config.WATCHED_FOLDERS_RECURSIVELY:
-                for root, _, files in os.walk(folder):
-                    files_to_unload.extend(
-                        os.path.join(root, file)
-                        for file in files
-                        if file.endswith(".py")
-                    )
+            files_to_unload = [
+                file
+                for folder in config.WATCHED_FOLDERS_RECURSIVELY
+                for file in walk_files(folder)
+                if file.endswith(".py")
+            ]
 
             # Gather files from watched folders
-            for folder in config.WATCHED_FOLDERS:
-                files_to_unload.extend(
-                    os.path.join(folder, file)
-                    for file in os.listdir(folder)
-                    if file.endswith(".py")
-                )
+            files_to_unload.extend(
+                file
+                for folder in config.WATCHED_FOLDERS
+                for file in walk_files(folder, recursive=False)
+                if file.endswith(".py")
+            )
 
             # Gather individual watched files
             files_to_unload.extend(
-                os.path.join(os.getcwd(), file) for file in config.WATCHED_FILES
+                os.path.join(self._cwd, file) for file in config.WATCHED_FILES
             )
 
             # Gather files that require full reload
             files_to_unload.extend(
-                os.path.join(os.getcwd(), file) for file in config.FULL_RELOAD_FILES
+                os.path.join(self._cwd, file) for file in config.FULL_RELOAD_FILES
             )
 
-            # Process all gathered files
-            self.unload_files(files_to_unload)
+            self._python_files_to_unload = files_to_unload
+            return files_to_unload
+
+        def get_imports_of_file(self, filename, module_name):
+            """
+            Returns the modules imported by a python file. The file is
+            only parsed again after its modification time or size change
+            """
+            try:
+                stat_key = get_file_stat_key(filename)
+                cached = self._imports_cache.get(filename)
+                if cached is not None and cached[0] == stat_key:
+                    return cached[1]
+                imports = find_imported_modules(filename, module_name)
+            except (OSError, SyntaxError, ValueError):
+                # The reload itself reports the error
+                return set()
+
+            self._imports_cache[filename] = (stat_key, imports)
+            return imports
+
+        def get_python_files_to_reload(self, changed_files):
+            """
+            Returns `changed_files` and the python files that import,
+            directly or not, one of them. They are ordered so every
+            file comes after the files it imports, so a module changed
+            along with one it imports sees its new content
+            """
+            files = {
+                self.get_module_name(file): file
+                for file in self.get_python_files_to_unload()
+            }
+            # A package is imported by its name, not by its __init__ module
+            names = {module.removesuffix(".__init__"): module for module in files}
+
+            dependents = {module: set() for module in files}
+            imports = {}
+            for module, file in files.items():
+                imports[module] = {
+                    names[name]
+                    for name in self.get_imports_of_file(file, module)
+                    if name in names and names[name] != module
+                }
+                for imported in imports[module]:
+                    dependents[imported].add(module)
+
+            changed = {self.get_module_name(file): file for file in changed_files}
+            # Changed files outside of the watched folders have no
+            # known dependents, they are reloaded first
+            unknown = [file for module, file in changed.items() if module not in files]
+            to_reload = {module for module in changed if module in files}
+            to_visit = list(to_reload)
+            while to_visit:
+                for dependent in dependents[to_visit.pop()]:
+                    if dependent not in to_reload:
+                        to_reload.add(dependent)
+                        to_visit.append(dependent)
+
+            try:
+                ordered = TopologicalSorter(
+                    {module: imports[module] & to_reload for module in to_reload}
+                ).static_order()
+                return unknown + [files[module] for module in ordered]
+            except CycleError:
+                return unknown + [
+                    files[module] for module in files if module in to_reload
+                ]
+
+        def unload_python_files_on_desktop(self, changed_files=None):
+            """
+            Reloads `changed_files` and the python files depending on
+            them, or every python file when it is not given
+            """
+            if changed_files is None:
+                files = self.get_python_files_to_unload()
+            else:
+                files = self.get_python_files_to_reload(changed_files)
+            self.unload_files(files)
+            # Every file is up to date, if one failed to reload they
+            # are all reloaded again along with the next change
+            self._unreloaded_python_files = []
+
+        def unload_app_dependencies(self):
+            """
+            Unloads the kv files before a rebuild. The factory classes
+            stay registered, the ones of a reloaded module are already
+            unregistered when the module is reloaded
+            """
+            for path in self._kv_realpaths:
+                Builder.unload_file(path)
 
         def load_app_dependencies(self):
-            for path in self.KV_FILES:
-                path = os.path.realpath(path)
-                if path not in Builder.files:
+            loaded_files = set(Builder.files)
+            for path in self._kv_realpaths:
+                if path not in loaded_files:
                     Builder.load_file(path)
+                    loaded_files.add(path)
+            # Only the classes unregistered since the last rebuild
             for name, module in self.CLASSES.items():
-                F.register(name, module=module)
+                if name not in F.classes:
+                    F.register(name, module=module)
 
-        def rebuild(self, dt=None, first=False, *args, **kwargs):
+        def rebuild(self, dt=None, first=False, changed_files=None, *args, **kwargs):
             Logger.info("Reloader: Rebuilding the application")
 
             try:
                 if not first:
                     self.unload_app_dependencies()
-                    self.unload_python_files_on_desktop()
-                    importlib.reload(importlib.import_module(self.__module__))
+                    self.unload_python_files_on_desktop(changed_files)
+                    app_module = sys.modules.get(self.__module__)
+                    if app_module is not None:
+                        importlib.reload(app_module)
                     Builder.rulectx = {}
                     self.load_app_dependencies()
 
@@ -277,7 +465,7 @@ if platform != "android":
                         "Reloader: Reloading on Android requires WSL installation: https://kivyschool.com/kivy-reloader-WindowsWSL/"
                     )
                 elif self.HOT_RELOAD_ON_PHONE:
-                    self.send_app_to_phone()
+                    self.start_sending_app_to_phone()
             except Exception as e:
                 import traceback
 
@@ -286,8 +474,25 @@ if platform != "android":
                 if not self.DEBUG and self.RAISE_ERROR:
                     raise
 
+        def create_observer(self):
+            """
+            Returns the watchdog observer chosen by WATCHER_BACKEND.
+            Polling is slower to notice changes, but does not miss the
+            events the native observer drops on network drives
+            """
+            from watchdog.observers import Observer
+
+            backend = config.WATCHER_BACKEND
+            if backend == "polling" or (
+                backend == "auto" and is_network_path(self._root_path)
+            ):
+                from watchdog.observers.polling import PollingObserver
+
+                return PollingObserver(timeout=config.POLLING_INTERVAL)
+            return Observer()
+
         def enable_autoreload(self):
-            if platform != "win":
+            if platform != "win" and config.WATCHER_BACKEND != "polling":
                 super().enable_autoreload()
                 return
 
@@ -296,89 +501,142 @@ if platform != "android":
                     FileSystemEventHandler,
                     PatternMatchingEventHandler,
                 )
-                from watchdog.observers import Observer
             except ImportError:
                 Logger.warn("Reloader: Unavailable, watchdog is not installed")
                 return
 
             Logger.info("Reloader: Autoreloader activated")
-            rootpath = self.get_root_path()
-            folder_handler = FileSystemEventHandler()
-            file_handler = PatternMatchingEventHandler()
-
-            folder_handler.dispatch = self._reload_from_watchdog
-            file_handler.dispatch = self._reload_from_watchdog
-
-            folder_observer = Observer()
-            file_observer = Observer()
-
+            rootpath = self._root_path
             patterns = [
                 os.path.abspath(os.path.join(rootpath, path))
                 for path in config.WATCHED_FILES + config.FULL_RELOAD_FILES
             ]
-            file_handler._patterns = patterns
-
-            dirs_to_watch_from_watched_files = list(
-                set([os.path.dirname(path) for path in patterns])
+            folder_handler = FileSystemEventHandler()
+            file_handler = PatternMatchingEventHandler(
+                patterns=patterns, ignore_directories=True
             )
 
-            for dir in dirs_to_watch_from_watched_files:
-                file_observer.schedule(file_handler, dir, **{"recursive": False})
-
-            for path in self.AUTORELOADER_PATHS:
-                path, options = path
-
-                # continue if it is not a directory
-                if not os.path.isdir(os.path.join(rootpath, path)):
-                    continue
+            folder_handler.dispatch = self._reload_from_watchdog
+            # The pattern matching happens in dispatch, so it is kept and
+            # only the events of the watched files reach the reloader
+            file_handler.on_any_event = self._reload_from_watchdog
+
+            # Both handlers share a single observer thread
+            observer = self.create_observer()
+
+            watched_folders = [
+                (os.path.join(rootpath, path), options.get("recursive", True))
+                for path, options in self.AUTORELOADER_PATHS
+                # files are watched through their folder below
+                if os.path.isdir(os.path.join(rootpath, path))
+            ]
+            folder_paths = {
+                os.path.abspath(folder) for folder, recursive in watched_folders
+            }
+            dirs_of_watched_files = {
+                (os.path.dirname(path), False) for path in patterns
+            }
 
-                folder_observer.schedule(
-                    folder_handler, os.path.join(rootpath, path), **options
-                )
+            # Folders inside a recursively watched folder are not
+            # scheduled again, their events already reach the reloader
+            for folder, recursive in merge_watched_folders(
+                watched_folders + list(dirs_of_watched_files)
+            ):
+                if folder in folder_paths:
+                    observer.schedule(folder_handler, folder, recursive=recursive)
+                else:
+                    observer.schedule(file_handler, folder, recursive=False)
 
-            file_observer.start()
-            folder_observer.start()
+            observer.start()
 
-        @mainthread
         def _reload_from_watchdog(self, event):
+            """
+            Runs on the watchdog thread. Drops the ignored files and
+            records the other changed paths, the batch is processed on
+            the main thread by `_flush_pending`
+            """
             from watchdog.events import FileModifiedEvent
 
+            if event.event_type in ("created", "deleted", "moved"):
+                # Only a watched python file or folder appearing or
+                # disappearing changes the files to unload, not i.e. the
+                # .pyc files written by every reload. Moving or deleting
+                # a folder only reports the folder, not its files
+                paths = (event.src_path, getattr(event, "dest_path", ""))
+                if any(
+                    path
+                    and (event.is_directory or path.endswith(".py"))
+                    and not self._should_ignore_file(path)
+                    for path in paths
+                ):
+                    self._python_files_to_unload = None
+                return
+
             if not isinstance(event, FileModifiedEvent):
                 return
 
-            if not os.path.exists(event.src_path):
+            path = event.src_path
+            # Ignored files do not even delay the pending rebuild.
+            # Full reload files win over the ignore patterns
+            is_ignored = self._should_ignore_file(path)
+            if is_ignored and not self._should_trigger_full_reload(path):
                 return
 
-            for path in config.FULL_RELOAD_FILES:
-                full_path = os.path.join(self.get_root_path(), path)
-                if fnmatch(event.src_path, full_path):
-                    Logger.info(f"Reloader: Full reload triggered by {event.src_path}")
-                    mod = sys.modules[self.__class__.__module__]
-                    mod_filename = os.path.realpath(mod.__file__)
-                    self._restart_app(mod_filename)
-                    break
+            with self._pending_lock:
+                self._pending_paths.add(path)
 
-            for pat in config.DO_NOT_WATCH_PATTERNS:
-                if fnmatch(event.src_path, pat):
-                    return
-                if fnmatch(event.src_path, os.path.join(os.getcwd(), pat)):
-                    return
+            # Restart the countdown, the batch is flushed once events settle
+            self._flush_trigger.cancel()
+            self._flush_trigger()
 
-            Logger.trace(f"Reloader: Event received {event.src_path}")
-            if event.src_path.endswith(".py"):
-                # source changed, reload it
-                try:
-                    Builder.unload_file(event.src_path)
-                    self._reload_py(event.src_path)
-                except Exception as e:
-                    import traceback
+        def _should_trigger_full_reload(self, file_path):
+            return self._is_full_reload_file(file_path)
+
+        def _should_ignore_file(self, file_path):
+            return self._is_ignored_file(file_path)
+
+        def _flush_pending(self, *args):
+            """
+            Handles every path changed since the last flush,
+            then rebuilds the app once
+            """
+            with self._pending_lock:
+                paths, self._pending_paths = self._pending_paths, set()
 
-                    self.set_error(repr(e), traceback.format_exc())
+            changed = []
+            for path in paths:
+                try:
+                    stat_key = get_file_stat_key(path)
+                except OSError:
+                    continue
+                # Events that did not actually change the file, i.e.
+                # changing its permissions. Comparing the stats costs
+                # no read, even for big assets
+                if self._flushed_stats.get(path) != stat_key:
+                    changed.append((path, stat_key))
+
+            # The app restarts anyway, so nothing is reloaded before.
+            # Like kaki does, changing the module of the app restarts it
+            mod = sys.modules[self.__class__.__module__]
+            mod_filename = os.path.realpath(mod.__file__)
+            for path, stat_key in changed:
+                if self._should_trigger_full_reload(path) or (
+                    os.path.realpath(path) == mod_filename
+                ):
+                    Logger.info(f"Reloader: Full reload triggered by {path}")
+                    self._restart_app(mod_filename)
                     return
 
-            Logger.debug(f"Reloader: Triggered by {event}")
-            Clock.unschedule(self.rebuild)
-            Clock.schedule_once(self.rebuild, 0.1)
+            for path, stat_key in changed:
+                Logger.trace(f"Reloader: Event received {path}")
+                if path.endswith(".py"):
+                    # Reloaded by the rebuild, in the order of their imports
+                    self._unreloaded_python_files.append(path)
+                self._flushed_stats[path] = stat_key
+
+            if changed:
+                Logger.debug(f"Reloader: Triggered by {len(changed)} changed file(s)")
+                self.rebuild(changed_files=self._unreloaded_python_files)
 
         @mainthread
         def set_error(self, exc, tb=None):
@@ -397,89 +655,142 @@ if platform != "android":
                 scroll_y=0,
             )
             sv.add_widget(lbl)
-            while Window.children:
-                Window.remove_widget(Window.children[0])
+            self.clear_window()
             Window.add_widget(sv)
 
-        def clear_temp_folder_and_zip_file(self, folder, zip_file):
-            if os.path.exists(folder):
-                rmtree(folder)
-            if os.path.exists(zip_file):
-                os.remove(zip_file)
-
-        def send_app_to_phone(self):
-            # Creating a copy of the files on `temp` folder
-            source = os.getcwd()
-            destination = os.path.join(os.getcwd(), "temp")
-            zip_file = os.path.join(os.getcwd(), "app_copy.zip")
-
-            self.clear_temp_folder_and_zip_file(destination, zip_file)
-
-            copytree(
-                source,
-                destination,
-                ignore=ignore_patterns(
-                    *config.FOLDERS_AND_FILES_TO_EXCLUDE_FROM_PHONE,
-                ),
-            )
+        def get_hash_of_file(self, file_name):
+            return get_file_hash(file_name, self._file_hash_cache)
 
-            # Zipping all files inside `temp` folder, except the `temp` folder itself
-            subprocess.run(
-                f"cd {destination} && zip -r ../app_copy.zip ./* -x ./temp",
-                shell=True,
-                stdout=subprocess.DEVNULL,
+        def create_app_archive(self, source, archive):
+            """
+            Zips the project files straight from `source` into the
+            `archive` file object, skipping
+            everything matched by FOLDERS_AND_FILES_TO_EXCLUDE_FROM_PHONE.
+            Excluded folders are pruned before being walked.
+
+            Only the files whose hash differs from the copy the phone
+            already has are added, along with a manifest of the deleted
+            files. Returns the hashes of every file of the project
+            """
+            is_excluded = compile_patterns(
+                *config.FOLDERS_AND_FILES_TO_EXCLUDE_FROM_PHONE
             )
+            file_hashes = {}
+
+            with zipfile.ZipFile(
+                archive,
+                "w",
+                zipfile.ZIP_DEFLATED,
+                compresslevel=self.ZIP_COMPRESS_LEVEL,
+            ) as zf, os.scandir(source) as entries:
+                for entry in entries:
+                    # Like the shell glob used before, hidden entries
+                    # at the top level are not sent
+                    if entry.name.startswith(".") or is_excluded(entry.name):
+                        continue
+
+                    if entry.is_dir():
+                        # Like copytree did, symlinked folders are
+                        # sent with their content
+                        paths = walk_files(
+                            entry.path, is_excluded=is_excluded, follow_symlinks=True
+                        )
+                    elif entry.is_file():
+                        paths = [entry.path]
+                    else:
+                        continue
 
-            # Sending the zip file to the phone
-            path_of_current_file = inspect.currentframe().f_back
-            path_of_send_app = os.path.join(
-                os.path.dirname(
-                    os.path.abspath(path_of_current_file.f_code.co_filename)
-                ),
-                "send_app_to_phone.py",
-            )
-            subprocess.run(f"python {path_of_send_app}", shell=True)
+                    for path in paths:
+                        arcname = os.path.relpath(path, source).replace(os.sep, "/")
+                        file_hash = self.get_hash_of_file(path)
+                        file_hashes[arcname] = file_hash
+                        if self._phone_file_hashes.get(arcname) != file_hash:
+                            zf.write(path, arcname)
 
-            # Deleting the temp folder and the zip file
-            self.clear_temp_folder_and_zip_file(destination, zip_file)
+                deleted_files = self._phone_file_hashes.keys() - file_hashes.keys()
+                if deleted_files:
+                    zf.writestr(DELETED_FILES_MANIFEST, "\n".join(deleted_files))
 
-        def _filename_to_module(self, filename: str):
-            rootpath = self.get_root_path()
-            if filename.startswith(rootpath):
-                filename = filename[len(rootpath) :]
+            return file_hashes
 
-            if platform == "macosx":
-                prefix = os.sep
+        def start_sending_app_to_phone(self):
+            """
+            Sends the app to the phone in the background, so the window
+            keeps drawing frames while the app is zipped and transferred.
+            The first build happens before the event loop runs, that
+            send starts along with it
+            """
+            nursery = getattr(self, "nursery", None)
+            if nursery is None:
+                self._send_on_start = True
             else:
-                prefix = os.path.sep
+                nursery.start_soon(self.send_app_to_phone)
+
+        async def send_app_to_phone(self):
+            # Sends overlap when rebuilding during a transfer, each one
+            # must be zipped against the files the previous one sent
+            async with self._send_lock:
+                try:
+                    # The archive never touches the disk
+                    archive = io.BytesIO()
+                    file_hashes = await trio.to_thread.run_sync(
+                        self.create_app_archive, self._cwd, archive
+                    )
+                    sent = await send_app(archive.getvalue())
+                except Exception:
+                    # A failed send must not bring the app down
+                    Logger.exception("Reloader: Error when sending app to phone")
+                    return
 
-            if filename.startswith(prefix):
-                filename = filename[1:]
-            module = filename[:-3].replace(prefix, ".")
+                if sent:
+                    # Next time, only what changed from now on is sent
+                    self._phone_file_hashes = file_hashes
+
+        def _filename_to_module(self, filename: str):
+            module = self._filename_modules.get(filename)
+            if module is not None:
+                return module
+
+            rootpath = self._root_path
+            path = filename
+            if path.startswith(rootpath):
+                path = path[len(rootpath) :]
+
+            prefix = os.sep
+            if path.startswith(prefix):
+                path = path[1:]
+            module = path[:-3].replace(prefix, ".")
+            self._filename_modules[filename] = module
             return module
 
 else:
     # Android BaseApp
-    import hashlib
-    import shutil
+    import zipfile
 
     from kivy.app import App
     from kivy.clock import Clock
 
+    from .utils import get_file_hash, walk_files
+
     class App(App):
         def __init__(self, *args, **kwargs):
             super().__init__(*args, **kwargs)
-            main_py_file_path = os.path.join(os.getcwd(), "main.py")
+            self._main_py_path = os.path.join(os.getcwd(), "main.py")
 
-            if os.path.exists(main_py_file_path):
-                self.main_py_hash = self.get_hash_of_file(main_py_file_path)
+            # file name -> ((mtime, size), hash), see `get_file_hash`
+            self._file_hash_cache = {}
+
+            if os.path.exists(self._main_py_path):
+                self.main_py_hash = self.get_hash_of_file(self._main_py_path)
             else:
                 self.main_py_hash = None
 
             # hot reload
+            # The kv paths only change when an archive brings new kv files
+            self._kv_paths = get_kv_files_paths()
             self.kv_files_hashes = {
                 file_name: self.get_hash_of_file(file_name)
-                for file_name in get_kv_files_paths()
+                for file_name in self._kv_paths
             }
 
             # live reload
@@ -505,12 +816,10 @@ else:
             """
 
             def _on_keyboard(window, keycode, scancode, codepoint, modifier_keys):
-                pressed_modifiers = set(modifier_keys)
-
-                if key == keycode and "ctrl" in pressed_modifiers:
+                if key == keycode and "ctrl" in modifier_keys:
                     return callback()
 
-            Window.bind(on_keyboard=_on_keyboard)
+            Window.fbind("on_keyboard", _on_keyboard)
 
         async def async_run(self, async_lib="trio"):
             async with trio.open_nursery() as nursery:
@@ -539,11 +848,7 @@ else:
             System.exit(0)
 
         def get_hash_of_file(self, file_name):
-            """
-            Returns the hash of the file using md5 hash
-            """
-            with open(file_name, "rb") as f:
-                return hashlib.md5(f.read()).hexdigest()
+            return get_file_hash(file_name, self._file_hash_cache)
 
         def _unregister_factory_from_module(self, module):
             to_remove = [x for x in F.classes if F.classes[x]["module"] == module]
@@ -564,7 +869,7 @@ else:
             Hot reloading kv files on Android
             """
             Logger.info("Reloading kv files")
-            main_py_file_path = os.path.join(os.getcwd(), "main.py")
+            main_py_file_path = self._main_py_path
 
             # reload the service files
             should_restart_app_on_android = False
@@ -631,20 +936,19 @@ else:
             # Reload only the kv files that changed
             current_kv_files_hashes = {
                 file_name: self.get_hash_of_file(file_name)
-                for file_name in get_kv_files_paths()
+                for file_name in self._kv_paths
             }
 
-            if current_kv_files_hashes != self.kv_files_hashes:
-                kv_files_that_changed = [
-                    file_name
-                    for file_name in current_kv_files_hashes
-                    if current_kv_files_hashes[file_name]
-                    != self.kv_files_hashes.get(file_name, None)
-                ]
+            # (file name, hash) pairs that are new or whose hash changed
+            kv_files_that_changed = (
+                current_kv_files_hashes.items() - self.kv_files_hashes.items()
+            )
+
+            for file_name, _ in kv_files_that_changed:
+                Builder.unload_file(file_name)
+                Builder.load_file(file_name)
 
-                for file_name in kv_files_that_changed:
-                    Builder.unload_file(file_name)
-                    Builder.load_file(file_name)
+            self.kv_files_hashes = current_kv_files_hashes
 
             self.build_root_and_add_to_window()
 
@@ -679,27 +983,19 @@ else:
             return None
 
         def gather_files_to_reload(self, folders, recursive=False):
-            files_to_reload = []
-            for folder in folders:
-                if recursive:
-                    for root, _, files in os.walk(folder):
-                        files_to_reload.extend(
-                            os.path.join(root, file)
-                            for file in files
-                            if file.endswith(".py")
-                        )
-                else:
-                    files_to_reload.extend(
-                        os.path.join(folder, file)
-                        for file in os.listdir(folder)
-                        if file.endswith(".py")
-                    )
-            return files_to_reload
+            return [
+                file
+                for folder in folders
+                for file in walk_files(folder, recursive)
+                if file.endswith(".py")
+            ]
 
         def process_unload_files(self, files):
             modules_to_reload = []
+            base_dir = os.getcwd()
             for filename in files:
-                module_name = os.path.relpath(filename).replace(os.path.sep, ".")[:-3]
+                module_name = os.path.relpath(filename, base_dir)
+                module_name = module_name.replace(os.path.sep, ".")[:-3]
                 to_reload = self.unload_python_file(filename, module_name)
                 if to_reload is not None:
                     modules_to_reload.append(to_reload)
@@ -783,6 +1079,56 @@ else:
                 )
                 Logger.info(e)
 
+        def unpack_app(self, zip_file_path):
+            """
+            Extracts the received zip file, removes the files listed
+            as deleted on the computer and deletes the zip file.
+            Returns the names of the extracted and of the removed files
+            """
+            base_dir = os.getcwd()
+            with zipfile.ZipFile(zip_file_path) as zf:
+                names = zf.namelist()
+                deleted_files = []
+                if DELETED_FILES_MANIFEST in names:
+                    names.remove(DELETED_FILES_MANIFEST)
+                    deleted_files = (
+                        zf.read(DELETED_FILES_MANIFEST).decode().splitlines()
+                    )
+                zf.extractall(members=names)
+            os.remove(zip_file_path)
+
+            # The manifest comes from the network, like extractall does,
+            # nothing outside of the app folder is touched
+            app_dir = os.path.join(os.path.realpath(base_dir), "")
+            removed_files = []
+            for file_name in deleted_files:
+                path = os.path.realpath(os.path.join(base_dir, file_name))
+                if not path.startswith(app_dir):
+                    Logger.warning(
+                        f"Reloader: Not removing {file_name!r}, it is outside of the app folder"
+                    )
+                    continue
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                removed_files.append(file_name)
+            return names, removed_files
+
+        def update_kv_paths(self, unpacked_files, deleted_files):
+            """
+            Looks for kv files again, only if the received app
+            brought kv files that were not known yet or deleted some
+            """
+            known_kv_paths = set(self._kv_paths)
+            base_dir = os.getcwd()
+            if any(file_name.endswith(".kv") for file_name in deleted_files) or any(
+                os.path.join(base_dir, file_name) not in known_kv_paths
+                for file_name in unpacked_files
+                if file_name.endswith(".kv")
+            ):
+                self._kv_paths = get_kv_files_paths()
+
         async def data_receiver(self, data_stream):
             """
             When data is received from the computer
@@ -795,24 +1141,22 @@ else:
 
             try:
                 zip_file_path = os.path.join(os.getcwd(), "app_copy.zip")
-                with open(zip_file_path, "wb") as myzip:
+                zip_file_size = 0
+                with open(zip_file_path, "wb", buffering=1024 * 1024) as myzip:
                     async for data in data_stream:
-                        Logger.info("Reloader: Server: received data")
-                        Logger.info(f"Reloader: Data size: {len(data)}")
-                        Logger.info("Reloader: Server: connection closed")
+                        zip_file_size += len(data)
                         myzip.write(data)
 
                 Logger.info("Reloader: Finished receiving all files from computer")
-                Logger.info("Reloader: Unpacking app")
-
-                # first print the size of the zip file
-                zip_file_size = os.path.getsize(zip_file_path)
                 Logger.info(f"Reloader: Zip file size: {zip_file_size}")
+                Logger.info("Reloader: Unpacking app")
 
-                shutil.unpack_archive(zip_file_path)
-
-                # Deleting the zip file
-                os.remove(zip_file_path)
+                # Extracting and deleting the zip file in a worker thread,
+                # so the event loop keeps drawing frames meanwhile
+                unpacked_files, deleted_files = await trio.to_thread.run_sync(
+                    self.unpack_app, zip_file_path
+                )
+                self.update_kv_paths(unpacked_files, deleted_files)
 
                 # Recompiling main.py
                 # Logger.info("Recompiling main.py")
@@ -822,8 +1166,9 @@ else:
                 Logger.info("Reloader: ************** END SERVER **************")
 
                 self.unload_python_files_on_android()
-                if self.__module__ != "__main__":
-                    importlib.reload(importlib.import_module(self.__module__))
+                app_module = sys.modules.get(self.__module__)
+                if app_module is not None and self.__module__ != "__main__":
+                    importlib.reload(app_module)
                 self.reload_kv()
 
             except Exception as e:
@@ -13,6 +13,8 @@ class Config:
             "WATCHED_FOLDERS",
             "WATCHED_FOLDERS_RECURSIVELY",
             "DO_NOT_WATCH_PATTERNS",
+            "WATCHER_BACKEND",
+            "POLLING_INTERVAL",
             "HOT_RELOAD_ON_PHONE",
             "STREAM_USING",
             "PORT",
@@ -73,6 +75,14 @@ class Config:
     def DO_NOT_WATCH_PATTERNS(self) -> List[str]:
         return self.get("DO_NOT_WATCH_PATTERNS", ["*.pyc", "*__pycache__*"])
 
+    @property
+    def WATCHER_BACKEND(self) -> str:
+        return self.get("WATCHER_BACKEND", "auto")
+
+    @property
+    def POLLING_INTERVAL(self) -> float:
+        return self.get("POLLING_INTERVAL", 1.0)
+
     @property
     def HOT_RELOAD_ON_PHONE(self) -> bool:
         return self.get("HOT_RELOAD_ON_PHONE", False)
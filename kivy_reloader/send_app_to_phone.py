@@ -1,49 +1,62 @@
+import sys
+
 import trio
-from colorama import Fore, Style, init
+from colorama import init
+from kivy.logger import Logger
 
 from kivy_reloader.config import config
 
-red = Fore.RED
-green = Fore.GREEN
-yellow = Fore.YELLOW
-white = Fore.WHITE
-init(autoreset=True)
-
 
 async def connect_to_server(IP):
     try:
         PORT = 8050
-        print(f"Connecting to IP: {green}{IP}{white} and PORT: {green}{config.PORT}")
+        Logger.info(f"Reloader: Connecting to IP: {IP} and PORT: {config.PORT}")
         with trio.move_on_after(1):
             client_socket = await trio.open_tcp_stream(IP, PORT)
             return client_socket
     except Exception as e:
-        print(f"{red}Error: {e}")
+        Logger.error(f"Reloader: Error: {e}")
         return None
 
 
-async def send_app():
-    print("*" * 50)
-    print(green + "Connecting to smartphone...")
-    for IP in config.PHONE_IPS:
-        client_socket = await connect_to_server(IP)
-        if not client_socket:
-            print(f"{yellow}Couldn't connect to smartphone")
-            return
-        print(f"{yellow} Phone connected successfully: {IP}")
-        print(f"\n{green}Sending app to smartphone...")
-        CHUNK_SIZE = 4096
-        with open(
-            "app_copy.zip",
-            "rb",
-        ) as myzip:
-            for chunk in iter(lambda: myzip.read(CHUNK_SIZE), b""):
-                print("Sending chunk")
-                await client_socket.send_all(chunk)
-        print(green + "Finished sending app!")
-    print("\n")
-    print(yellow + f"Sent app to {len(config.PHONE_IPS)} smartphone(s)")
-    print("*" * 50)
-
-
-trio.run(send_app)
+async def send_app_to_ip(IP, app_data):
+    client_socket = await connect_to_server(IP)
+    if not client_socket:
+        Logger.warning(f"Reloader: Couldn't connect to smartphone: {IP}")
+        return False
+    Logger.info(f"Reloader: Phone connected successfully: {IP}")
+    Logger.info("Reloader: Sending app to smartphone...")
+    try:
+        async with client_socket:
+            await client_socket.send_all(app_data)
+    except (trio.BrokenResourceError, OSError) as e:
+        Logger.error(f"Reloader: Error: {e}")
+        return False
+    Logger.info(f"Reloader: Finished sending app to {IP}!")
+    return True
+
+
+async def send_app(app_data):
+    Logger.info("Reloader: Connecting to smartphone...")
+    results = []
+
+    async def send(IP):
+        results.append(await send_app_to_ip(IP, app_data))
+
+    # Every phone gets the app at the same time
+    async with trio.open_nursery() as nursery:
+        for IP in config.PHONE_IPS:
+            nursery.start_soon(send, IP)
+
+    Logger.info(f"Reloader: Sent app to {sum(results)} smartphone(s)")
+    return all(results)
+
+
+if __name__ == "__main__":
+    # Only when run as a script, importing it must not wrap
+    # sys.stdout and sys.stderr of the app
+    init(autoreset=True)
+
+    # Sends a zipped app piped in through stdin
+    if not trio.run(send_app, sys.stdin.buffer.read()):
+        sys.exit(1)
@@ -1,7 +1,13 @@
+import ast
+import fnmatch
+import hashlib
 import logging
+import mmap
 import os
 import pathlib
+import re
 import sys
+from functools import lru_cache
 
 from kivy.lang import Builder
 from kivy.resources import resource_add_path, resource_find
@@ -71,13 +77,200 @@ def get_auto_reloader_paths():
         )
 
 
+def merge_watched_folders(folders):
+    """
+    Takes (folder, recursive) pairs and returns them without duplicates
+    and without the folders already covered by the recursive watch of
+    a parent folder, so each change is watched by a single handle
+    """
+    merged = {}
+    for folder, recursive in folders:
+        folder = os.path.abspath(folder)
+        merged[folder] = merged.get(folder, False) or recursive
+
+    recursive_prefixes = [
+        os.path.join(os.path.normcase(folder), "")
+        for folder, recursive in merged.items()
+        if recursive
+    ]
+    return [
+        (folder, recursive)
+        for folder, recursive in merged.items()
+        if not os.path.normcase(folder).startswith(tuple(recursive_prefixes))
+    ]
+
+
+def is_network_path(path):
+    """
+    Tells if `path` is on a network drive, where the native file
+    system events are unreliable. Only detected on Windows
+    """
+    if platform != "win":
+        return False
+
+    path = os.path.abspath(path)
+    if path.startswith("\\\\"):
+        # UNC path, i.e. \\server\share
+        return True
+
+    import ctypes
+
+    DRIVE_REMOTE = 4
+    drive = os.path.splitdrive(path)[0] + "\\"
+    return ctypes.windll.kernel32.GetDriveTypeW(drive) == DRIVE_REMOTE
+
+
+_has_wildcards = re.compile(r"[*?[]").search
+
+
+@lru_cache(maxsize=None)
+def compile_patterns(*patterns):
+    """
+    Compiles glob patterns into a single regex, once per set of patterns.
+    Patterns without wildcards are looked up in a set instead.
+    Returns a function that tells if a name matches any of the patterns,
+    with the same case rules as `fnmatch.fnmatch`
+    """
+    patterns = [os.path.normcase(p) for p in patterns]
+    literals = {p for p in patterns if not _has_wildcards(p)}
+    globs = [p for p in patterns if p not in literals]
+    if not globs:
+        return lambda name: os.path.normcase(name) in literals
+
+    regex = re.compile("|".join(fnmatch.translate(p) for p in globs))
+
+    def match(name):
+        name = os.path.normcase(name)
+        return name in literals or regex.match(name) is not None
+
+    return match
+
+
+def walk_files(folder, recursive=True, is_excluded=None, follow_symlinks=False):
+    """
+    Yields the path of every file inside `folder`, and inside its
+    subfolders if `recursive` is True.
+    Files and folders whose name matches `is_excluded` are skipped,
+    excluded folders are not even opened.
+    Symlinked folders are skipped, unless `follow_symlinks` is True.
+    Then each folder is only walked once, so symlink loops end.
+    Uses os.scandir so the file type comes with the directory entry
+    instead of costing an extra stat per entry
+    """
+    visited = set() if follow_symlinks else None
+    if visited is not None:
+        try:
+            stat = os.stat(folder)
+        except OSError:
+            return
+        visited.add((stat.st_dev, stat.st_ino))
+    yield from _walk_files(folder, recursive, is_excluded, visited)
+
+
+def _walk_files(folder, recursive, is_excluded, visited):
+    try:
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                if is_excluded is not None and is_excluded(entry.name):
+                    continue
+                if entry.is_dir(follow_symlinks=visited is not None):
+                    if not recursive:
+                        continue
+                    if visited is not None:
+                        # DirEntry.stat has no inode on Windows
+                        stat = os.stat(entry.path)
+                        key = (stat.st_dev, stat.st_ino)
+                        if key in visited:
+                            continue
+                        visited.add(key)
+                    yield from _walk_files(entry.path, True, is_excluded, visited)
+                elif entry.is_file():
+                    yield entry.path
+    except OSError:
+        return
+
+
+def hash_file(file_name, chunk_size=1024 * 1024):
+    """
+    Returns the blake2b hash of a file. Files bigger than `chunk_size`
+    are memory mapped, so they are hashed straight from the page cache
+    instead of being copied into memory. Smaller files, and the ones
+    that can not be mapped, are read in chunks
+    """
+    file_hash = hashlib.blake2b(digest_size=16)
+    with open(file_name, "rb") as f:
+        if os.fstat(f.fileno()).st_size > chunk_size:
+            try:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except (OSError, ValueError):
+                mapped = None
+            if mapped is not None:
+                with mapped:
+                    file_hash.update(mapped)
+                return file_hash.hexdigest()
+
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            file_hash.update(chunk)
+    return file_hash.hexdigest()
+
+
+def get_file_stat_key(file_name):
+    """
+    Returns the modification time and size of a file. The reloader
+    considers a file changed only when they change, on the desktop
+    and for the files sent to the phone alike. The polling observer
+    used on network drives detects changes the same way
+    """
+    stat = os.stat(file_name)
+    return stat.st_mtime_ns, stat.st_size
+
+
+def get_file_hash(file_name, cache):
+    """
+    Returns the hash of a file, reusing the one stored in `cache`
+    while the stat key of the file does not change
+    """
+    stat_key = get_file_stat_key(file_name)
+    cached = cache.get(file_name)
+    if cached is not None and cached[0] == stat_key:
+        return cached[1]
+
+    digest = hash_file(file_name)
+    cache[file_name] = (stat_key, digest)
+    return digest
+
+
+def find_imported_modules(filename, module_name):
+    """
+    Returns the names of the modules imported by the python file
+    `filename`, whose module name is `module_name`.
+    Relative imports are resolved against it
+    """
+    with open(filename, "rb") as f:
+        tree = ast.parse(f.read(), filename)
+
+    imported = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            imported.update(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom):
+            if node.level:
+                package = module_name.rsplit(".", node.level)[0]
+                base = f"{package}.{node.module}" if node.module else package
+            else:
+                base = node.module
+            imported.add(base)
+            # `from package import module` imports a module too
+            imported.update(f"{base}.{alias.name}" for alias in node.names)
+    return imported
+
+
 def find_kv_files_in_folder(folder):
-    kv_files = []
-    for root, _, files in os.walk(os.path.join(base_dir, folder)):
-        for file in files:
-            if file.endswith(".kv"):
-                kv_files.append(os.path.join(root, file))
-    return kv_files
+    return [
+        file
+        for file in walk_files(os.path.join(base_dir, folder))
+        if file.endswith(".kv")
+    ]
 
 
 def get_kv_files_paths():
@@ -85,18 +278,15 @@ def get_kv_files_paths():
     Given the folders on WATCHED_FOLDERS and WATCHED_FOLDERS_RECURSIVELY,
     returns a list of all the kv files paths
     """
-    KV_FILES = []
+    # Collected in a set so duplicates are dropped as they are found
+    KV_FILES = set()
 
     for folder in config.WATCHED_FOLDERS:
         for file_name in os.listdir(folder):
             if file_name.endswith(".kv"):
-                KV_FILES.append(os.path.join(base_dir, f"{folder}/{file_name}"))
+                KV_FILES.add(os.path.join(base_dir, f"{folder}/{file_name}"))
 
     for folder in config.WATCHED_FOLDERS_RECURSIVELY:
-        for file_name in find_kv_files_in_folder(folder):
-            KV_FILES.append(file_name)
-
-    # Removing duplicates
-    KV_FILES = list(set(KV_FILES))
+        KV_FILES.update(find_kv_files_in_folder(folder))
 
-    return KV_FILES
+    return list(KV_FILES)